@@ -1,7 +1,10 @@
+import copy
 import difflib
 import glob
+import io
 import itertools as it
 import os
+import stat
 from typing import List
 
 import parmed as pmd
@@ -619,6 +622,149 @@ class TestForcefield(BaseTest):
                     == '[<!--Note: original overrides="opls_144"-->]'
                 )
 
+    def test_write_xml_compact(self, oplsaa):
+        mol = pmd.load_file(get_fn("benzene.mol2"), structure=True)
+        typed = oplsaa.apply(mol)
+        typed.write_foyer(
+            filename="opls-pretty.xml", forcefield=oplsaa, pretty=True
+        )
+        typed.write_foyer(
+            filename="opls-compact.xml", forcefield=oplsaa, pretty=False
+        )
+
+        pretty = ET.parse("opls-pretty.xml").getroot()
+        compact = ET.parse("opls-compact.xml").getroot()
+        assert pretty.text == "\n  "
+        assert compact.text is None
+        assert [(elem.tag, dict(elem.attrib)) for elem in pretty.iter()] == [
+            (elem.tag, dict(elem.attrib)) for elem in compact.iter()
+        ]
+
+        typed_by_compact = Forcefield("opls-compact.xml").apply(mol)
+        assert len(typed.bonds) == len(typed_by_compact.bonds)
+
+    def test_write_xml_without_forcefield(self, oplsaa):
+        mol = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+        typed = oplsaa.apply(mol)
+        typed.write_foyer(filename="opls-no-ff.xml", forcefield=None)
+        root = ET.parse("opls-no-ff.xml").getroot()
+        masses = {atom.atom_type.name: str(atom.mass) for atom in typed.atoms}
+        atom_types = root.find("AtomTypes").findall("Type")
+        assert len(atom_types) == len(masses)
+        for atom_type in atom_types:
+            assert atom_type.get("mass") == masses[atom_type.get("name")]
+            for attrib in ("class", "element", "def", "desc", "doi"):
+                assert atom_type.get(attrib) == ""
+            assert atom_type.get("overrides") == ""
+
+    @pytest.mark.parametrize("dedup_mode", ["sort", "none"])
+    def test_write_xml_dedup_mode(self, dedup_mode, oplsaa):
+        mol = pmd.load_file(get_fn("benzene.mol2"), structure=True)
+        typed = oplsaa.apply(mol)
+        typed.write_foyer(
+            filename="opls-dedup.xml", forcefield=oplsaa, dedup_mode=dedup_mode
+        )
+        root = ET.parse("opls-dedup.xml").getroot()
+        assert len(root.find("AtomTypes").findall("Type")) == 2
+        assert len(root.find("NonbondedForce").findall("Atom")) == 2
+        assert len(root.find("HarmonicBondForce").findall("Bond")) == 2
+
+        typed_by_written = Forcefield("opls-dedup.xml").apply(mol)
+        assert len(typed.bonds) == len(typed_by_written.bonds)
+
+    def test_write_xml_dedup_mode_order(self, oplsaa):
+        mol = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+        typed = oplsaa.apply(mol)
+        # List the C-H bonds before the C-C bond, unlike the sorted order
+        typed.bonds.sort(key=lambda bond: bond.atom1.type == bond.atom2.type)
+        bond_types = dict()
+        for dedup_mode in ("sort", "none"):
+            filename = "opls-{}.xml".format(dedup_mode)
+            typed.write_foyer(
+                filename=filename, forcefield=oplsaa, dedup_mode=dedup_mode
+            )
+            bonds = ET.parse(filename).getroot().find("HarmonicBondForce")
+            bond_types[dedup_mode] = [
+                (bond.get("type1"), bond.get("type2")) for bond in bonds
+            ]
+        assert bond_types["none"] == [
+            ("opls_135", "opls_140"),
+            ("opls_135", "opls_135"),
+        ]
+        assert bond_types["sort"] == bond_types["none"][::-1]
+
+    def test_write_xml_bad_dedup_mode(self, oplsaa):
+        mol = pmd.load_file(get_fn("benzene.mol2"), structure=True)
+        typed = oplsaa.apply(mol)
+        with pytest.raises(ValueError):
+            typed.write_foyer(
+                filename="opls-dedup.xml", forcefield=oplsaa, dedup_mode="bad"
+            )
+
+    def test_write_xml_error_keeps_file(self, oplsaa):
+        mol = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+        typed = oplsaa.apply(mol)
+        adjust_type = copy.copy(typed.adjusts[0].type)
+        adjust_type.chgscale = 0.123
+        typed.adjusts[0].type = adjust_type
+
+        with open("opls-error.xml", "w") as f:
+            f.write("original")
+        with pytest.raises(ValueError):
+            typed.write_foyer(filename="opls-error.xml", forcefield=oplsaa)
+        with open("opls-error.xml") as f:
+            assert f.read() == "original"
+        assert os.listdir(".") == ["opls-error.xml"]
+
+    def test_write_xml_file_object(self, oplsaa):
+        mol = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+        typed = oplsaa.apply(mol)
+        typed.write_foyer(filename="opls-path.xml", forcefield=oplsaa)
+        buffer = io.BytesIO()
+        typed.write_foyer(filename=buffer, forcefield=oplsaa)
+        with open("opls-path.xml", "rb") as f:
+            assert buffer.getvalue() == f.read()
+
+    def test_write_xml_through_symlink(self, oplsaa):
+        mol = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+        typed = oplsaa.apply(mol)
+        with open("opls-target.xml", "w") as f:
+            f.write("original")
+        os.chmod("opls-target.xml", 0o600)
+        os.symlink("opls-target.xml", "opls-link.xml")
+        typed.write_foyer(filename="opls-link.xml", forcefield=oplsaa)
+        assert os.path.islink("opls-link.xml")
+        assert stat.S_IMODE(os.stat("opls-target.xml").st_mode) == 0o600
+        root = ET.parse("opls-target.xml").getroot()
+        assert root.tag == "ForceField"
+
+    def test_write_xml_not_unique(self, oplsaa):
+        mol = pmd.load_file(get_fn("ethane.mol2"), structure=True)
+        typed = oplsaa.apply(mol)
+        typed.write_foyer(
+            filename="opls-topology.xml", forcefield=oplsaa, unique=False
+        )
+        root = ET.parse("opls-topology.xml").getroot()
+
+        names = [t.get("name") for t in root.find("AtomTypes").iter("Type")]
+        assert names == sorted(set(atom.type for atom in typed.atoms))
+
+        atoms = root.find("NonbondedForce").findall("Atom")
+        assert [a.get("id") for a in atoms] == [
+            str(atom.idx) for atom in typed.atoms
+        ]
+
+        for section, tag, terms, n_atoms in [
+            ("HarmonicBondForce", "Bond", typed.bonds, 2),
+            ("HarmonicAngleForce", "Angle", typed.angles, 3),
+            ("RBTorsionForce", "Proper", typed.rb_torsions, 4),
+        ]:
+            records = root.find(section).findall(tag)
+            assert len(records) == len(terms)
+            for record in records:
+                for i in range(1, n_atoms + 1):
+                    assert record.get("id{}".format(i)) is not None
+
     def test_load_metadata(self):
         lj_ff = Forcefield(get_fn("lj.xml"))
         assert lj_ff.version == "0.4.1"
@@ -0,0 +1,82 @@
+import warnings
+from types import SimpleNamespace
+
+import pytest
+
+from foyer.xml_writer import _infer_lj14scale
+
+
+def _make_struct(*pairs):
+    """Build a minimal stand-in for a structure with the given 1-4 pairs.
+
+    Each pair is ``((sigma1, epsilon1), (sigma2, epsilon2), (sigma, epsilon))``
+    holding the two atom types and the 1-4 parameters of the adjust.
+    """
+    adjusts = list()
+    for type1, type2, adj_type in pairs:
+        adjusts.append(
+            SimpleNamespace(
+                atom1=SimpleNamespace(
+                    atom_type=SimpleNamespace(sigma=type1[0], epsilon=type1[1])
+                ),
+                atom2=SimpleNamespace(
+                    atom_type=SimpleNamespace(sigma=type2[0], epsilon=type2[1])
+                ),
+                type=SimpleNamespace(sigma=adj_type[0], epsilon=adj_type[1]),
+            )
+        )
+    return SimpleNamespace(adjusts=adjusts)
+
+
+class TestInferLJ14Scale:
+    def test_lorentz(self):
+        struct = _make_struct(
+            ((3.0, 0.25), (4.0, 1.0), (3.5, 0.25)),
+            ((3.0, 0.25), (3.0, 0.25), (3.0, 0.125)),
+        )
+        assert _infer_lj14scale(struct, "lorentz") == pytest.approx(0.5)
+
+    def test_geometric(self):
+        struct = _make_struct(
+            ((2.0, 0.25), (8.0, 1.0), (4.0, 0.25)),
+            ((2.0, 0.25), (2.0, 0.25), (2.0, 0.125)),
+        )
+        assert _infer_lj14scale(struct, "geometric") == pytest.approx(0.5)
+
+    def test_sigma_mismatch(self):
+        struct = _make_struct(((2.0, 0.25), (8.0, 1.0), (4.0, 0.25)))
+        with pytest.raises(
+            ValueError,
+            match="Unexpected 1-4 sigma value.*combining rule of lorentz",
+        ):
+            _infer_lj14scale(struct, "lorentz")
+
+    def test_inconsistent_scales(self):
+        struct = _make_struct(
+            ((3.0, 0.25), (3.0, 0.25), (3.0, 0.125)),
+            ((3.0, 0.25), (3.0, 0.25), (3.0, 0.25)),
+        )
+        with pytest.raises(ValueError, match="inconsistent 1-4 LJ"):
+            _infer_lj14scale(struct, "lorentz")
+
+    def test_zero_epsilon_skipped(self):
+        struct = _make_struct(
+            ((3.0, 0.25), (1.0, 0.0), (2.0, 0.0)),
+            ((3.0, 0.25), (3.0, 0.25), (3.0, 0.125)),
+        )
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            assert _infer_lj14scale(struct, "lorentz") == pytest.approx(0.5)
+
+    def test_zero_epsilon_scaled(self):
+        struct = _make_struct(
+            ((3.0, 0.25), (1.0, 0.0), (2.0, 0.1)),
+            ((3.0, 0.25), (3.0, 0.25), (3.0, 0.125)),
+        )
+        with pytest.raises(ValueError, match="Unexpected 1-4 epsilon value"):
+            _infer_lj14scale(struct, "lorentz")
+
+    def test_all_zero_epsilon(self):
+        struct = _make_struct(((1.0, 0.0), (1.0, 0.0), (1.0, 0.0)))
+        with pytest.raises(ValueError, match="epsilon of zero"):
+            _infer_lj14scale(struct, "lorentz")
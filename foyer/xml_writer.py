@@ -1,7 +1,12 @@
 """Write foyer XMLs from a parametrized structure."""
 from __future__ import division
 
-import collections
+import contextlib
+import functools
+import operator
+import os
+import shutil
+import uuid
 import warnings
 
 import gmso
@@ -12,6 +17,77 @@ from lxml import etree as ET
 
 from foyer.smarts_graph import SMARTSGraph
 
+# Unit conversions from ParmEd (kcal/mol, degrees) to Foyer (kJ/mol, radians)
+_KCAL_TO_KJ = 4.184
+_DEG_TO_RAD = np.pi / 180.0
+
+# Attribute names of the Ryckaert-Bellemans coefficients
+_C_KEYS = ("c0", "c1", "c2", "c3", "c4", "c5")
+
+# Getters pulling the atom types, atom indices, type and parameters of a
+# ParmEd term in a single call
+_BOND_GETTER = operator.attrgetter("atom1.type", "atom2.type", "type")
+_BOND_PARAMETERS = operator.attrgetter("req", "k")
+_BOND_IDS = operator.attrgetter("atom1.idx", "atom2.idx")
+_ANGLE_GETTER = operator.attrgetter(
+    "atom1.type", "atom2.type", "atom3.type", "type"
+)
+_ANGLE_PARAMETERS = operator.attrgetter("theteq", "k")
+_ANGLE_IDS = operator.attrgetter("atom1.idx", "atom2.idx", "atom3.idx")
+_TORSION_TYPES = operator.attrgetter(
+    "atom1.type", "atom2.type", "atom3.type", "atom4.type"
+)
+_TORSION_IDS = operator.attrgetter(
+    "atom1.idx", "atom2.idx", "atom3.idx", "atom4.idx"
+)
+_DIHEDRAL_PARAMETERS = operator.attrgetter("per", "phase", "phi_k")
+_RB_COEFFICIENTS = operator.attrgetter(*_C_KEYS)
+
+
+# Formatted parameters are cached by value: atoms, bonds, etc. sharing a
+# type repeat the same few values many times over in large systems. Values
+# are rounded by the fixed-point format itself rather than by `round`.
+@functools.lru_cache(maxsize=8192)
+def _format_charge(charge):
+    return "%.4f" % charge
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_sigma(sigma):
+    return "%.4f" % (sigma / 10)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_epsilon(epsilon):
+    return "%.6f" % (epsilon * _KCAL_TO_KJ)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_bond_parameters(req, k):
+    return "%.4f" % (req / 10), "%.1f" % (k * _KCAL_TO_KJ * 200)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_angle_parameters(theteq, k):
+    return (
+        "%.10f" % (theteq * _DEG_TO_RAD),
+        "%.3f" % (k * _KCAL_TO_KJ * 2),
+    )
+
+
+@functools.lru_cache(maxsize=4096, typed=True)
+def _format_periodic_torsion_parameters(per, phase, phi_k):
+    return (
+        str(per),
+        "%.8f" % (phase * _DEG_TO_RAD),
+        "%.3f" % (phi_k * _KCAL_TO_KJ),
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_rb_torsion_parameters(*coefficients):
+    return tuple("%.4f" % (c * _KCAL_TO_KJ) for c in coefficients)
+
 
 def write_foyer(
     self,
@@ -20,6 +96,8 @@ def write_foyer(
     unique=True,
     name="Forcefield",
     version="0.0.1",
+    pretty=False,
+    dedup_mode="sort",
 ):
     """Output a Foyer XML from a ParmEd Structure.
 
@@ -46,8 +124,9 @@ def write_foyer(
 
     Parameters
     ----------
-    filename : str
-        Name of the Foyer XML file to be written
+    filename : str, os.PathLike or file-like
+        Name of the Foyer XML file to be written, or a binary file object to
+        write it to
     name : str, optional, default="Forcefield"
         User defined name for the Forcefield, default to "Forcefield"
     version : str, optional, default="0.0.1"
@@ -60,6 +139,16 @@ def write_foyer(
         Write only unique elements. If False, elements are written for each
         atom, bond, etc. in the system. `unique=False` is primarily used
         for storing the topology of "test" molecules for a Foyer forcefield.
+    pretty : boolean, optional, default=False
+        Start every section of the XML on its own line to make it easier to
+        read. The records within a section are not indented, which keeps
+        this as cheap as the default compact output for large systems.
+    dedup_mode : str, optional, default="sort"
+        Every section is always built without duplicate records. "sort"
+        orders the records of each section by atom type, while "none" keeps
+        them in the order they are first found in the Structure, saving the
+        sort for large systems. With `unique=False` only the atom types are
+        sorted.
 
     """
     # Assume if a Structure has a bond and bond type that the Structure is
@@ -68,107 +157,208 @@ def write_foyer(
         raise Exception(
             "Cannot write Foyer XML from an unparametrized " "Structure."
         )
-
-    root = ET.Element("ForceField")
-    # Write Forcefield information
-    root.set("name", name)
-    root.set("version", version)
-    root.set("combining_rule", self.combining_rule)
-    if isinstance(self, pmd.Structure):
-        _write_atoms(self, root, self.atoms, forcefield, unique)
-        if len(self.bonds) > 0 and self.bonds[0].type is not None:
-            _write_bonds(root, self.bonds, unique)
-        if len(self.angles) > 0 and self.angles[0].type is not None:
-            _write_angles(root, self.angles, unique)
-        if len(self.dihedrals) > 0 and self.dihedrals[0].type is not None:
-            _write_periodic_torsions(root, self.dihedrals, unique)
-        if len(self.rb_torsions) > 0 and self.rb_torsions[0].type is not None:
-            _write_rb_torsions(root, self.rb_torsions, unique)
-
-    # TO DO
-    elif isinstance(self, gmso.Topology):
-        raise FoyerError(
-            "Currently, cannot write foyer XML file from a gmso.Topology. "
-            "This feature will be implemented in future releases."
+    if dedup_mode not in ("none", "sort"):
+        raise ValueError(
+            "Unsupported dedup_mode {}, expected 'none' or 'sort'".format(
+                dedup_mode
+            )
         )
 
-    _remove_duplicate_elements(root, unique)
+    forcefield_attrib = {
+        "name": name,
+        "version": version,
+        "combining_rule": self.combining_rule,
+    }
+    with _replace_on_success(filename) as tmp_filename, ET.xmlfile(
+        tmp_filename, encoding="utf-8"
+    ) as xf:
+        with xf.element("ForceField", attrib=forcefield_attrib):
+            if isinstance(self, pmd.Structure):
+                _write_atoms(
+                    self, xf, self.atoms, forcefield, unique, dedup_mode, pretty
+                )
+                if len(self.bonds) > 0 and self.bonds[0].type is not None:
+                    _write_bonds(xf, self.bonds, unique, dedup_mode, pretty)
+                if len(self.angles) > 0 and self.angles[0].type is not None:
+                    _write_angles(xf, self.angles, unique, dedup_mode, pretty)
+                if (
+                    len(self.dihedrals) > 0
+                    and self.dihedrals[0].type is not None
+                ):
+                    _write_periodic_torsions(
+                        xf, self.dihedrals, unique, dedup_mode, pretty
+                    )
+                if (
+                    len(self.rb_torsions) > 0
+                    and self.rb_torsions[0].type is not None
+                ):
+                    _write_rb_torsions(
+                        xf, self.rb_torsions, unique, dedup_mode, pretty
+                    )
+
+            # TO DO
+            elif isinstance(self, gmso.Topology):
+                raise FoyerError(
+                    "Currently, cannot write foyer XML file from a "
+                    "gmso.Topology. This feature will be implemented in "
+                    "future releases."
+                )
 
-    ET.ElementTree(root).write(filename, pretty_print=True)
+            if pretty:
+                xf.write("\n")
 
 
-def _write_atoms(self, root, atoms, forcefield, unique):
-    combining_rule = getattr(forcefield, "combining_rule", "lorentz")
+@contextlib.contextmanager
+def _replace_on_success(filename):
+    """Yield what to write to, so that a failed write leaves `filename` intact.
 
-    atomtypes = ET.SubElement(root, "AtomTypes")
-    nonbonded = ET.SubElement(root, "NonbondedForce")
-    nonbonded.set("coulomb14scale", str(_infer_coulomb14scale(self)))
-    nonbonded.set("lj14scale", str(_infer_lj14scale(self, combining_rule)))
-    atomtype_attrs = collections.OrderedDict(
-        [
-            ("name", "name"),
-            ("class", "forcefield.atomTypeClasses[name]"),
-            ("element", "forcefield.atomTypeElements[name]"),
-            ("mass", "atom.mass"),
-            ("def", "forcefield.atomTypeDefinitions[name]"),
-            ("desc", "forcefield.atomTypeDesc[name]"),
-            ("doi", "forcefield.atomTypeRefs[name]"),
-            ("overrides", "forcefield.atomTypeOverrides[name]"),
-        ]
+    The XML is streamed while it is generated, so a path is written to a
+    temporary file next to the file it points to (following symlinks) and
+    moved onto it once complete. An existing file keeps its mode, but is
+    then owned by the writing user. File objects are written to directly.
+    """
+    if not isinstance(filename, (str, bytes, os.PathLike)):
+        yield filename
+        return
+    filename = os.fsdecode(os.path.realpath(filename))
+    dirname, basename = os.path.split(filename)
+    tmp_filename = os.path.join(
+        dirname, ".{}.{}.tmp".format(basename, uuid.uuid4().hex)
     )
-    atom_type_set = set([atom.atom_type.name for atom in atoms])
-    for atom in atoms:
-        atomtype = ET.SubElement(atomtypes, "Type")
-        nb_force = ET.SubElement(nonbonded, "Atom")
+    try:
+        yield tmp_filename
+        if os.path.exists(filename):
+            shutil.copymode(filename, tmp_filename)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
 
-        name = atom.atom_type.name
-        for key, val in atomtype_attrs.items():
-            """
-            I'm not crazy about using `eval` here, but this is where we want
-            to handle `AttributeError` and `KeyError` exceptions to pass a
-            blank string for these attributes.
-            """
-            try:
-                if key == "doi":
-                    label = eval(val)  # [a for a in label]
-                    label = ",".join([a for a in label])
-                elif key == "overrides":
-                    # Only write overrides atomtypes if they are in atom_type_set
-                    label = []
-                    original_label = []
-                    for item in eval(val):
-                        original_label.append(item)
-                        if item in atom_type_set:
-                            label.append(item)
-                    if len(label) == 0:
-                        label = ""
-                    else:
-                        label = ",".join([a for a in label])
-                    # Write out the original overrides atomtypes as a comment
-                    atomtype.append(
-                        ET.Comment(
-                            'Note: original overrides="{}"'.format(
-                                ",".join([a for a in original_label])
-                            )
-                        )
-                    )
-                else:
-                    label = str(eval(val))
-            except (AttributeError, KeyError):
-                label = ""
-            atomtype.set(key, label)
 
-        if not unique:
-            nb_force.set("id", str(atom.idx))
-        nb_force.set("type", name)
-        nb_force.set("charge", str(round(atom.charge, 4)))
-        nb_force.set("sigma", str(round(atom.atom_type.sigma / 10, 4)))
-        nb_force.set("epsilon", str(round(atom.atom_type.epsilon * 4.184, 6)))
+def _write_indent(xf, pretty):
+    """Start a top-level section on a new, indented line if `pretty`.
+
+    Only the few section boundaries are written this way, so the records
+    themselves never have to be walked to indent them.
+    """
+    if pretty:
+        xf.write("\n  ")
+
+
+@contextlib.contextmanager
+def _write_section(xf, tag, unique, dedup_mode, pretty, attrib=None):
+    """Open a force section in `xf` and yield a function adding records.
 
-    _update_defs(atomtypes, nonbonded, forcefield)
+    The yielded function takes the tag and attribute dict of one record.
+    When `unique` is True duplicate records are dropped as they are added,
+    so only one element per unique record is ever created. The writers also
+    skip terms sharing a ParmEd type and atom types with a term already
+    added, as those give the same record, before formatting them. Otherwise
+    every record is streamed straight to the file and freed as soon as it
+    is written.
+    """
+    if unique:
+        records = dict()
+        setdefault = records.setdefault
+
+        def add_record(record_tag, attrib):
+            setdefault(
+                (record_tag, frozenset(attrib.items())), (record_tag, attrib)
+            )
 
+        yield add_record
+        section = ET.Element(tag, attrib=attrib)
+        for record_tag, record_attrib in records.values():
+            ET.SubElement(section, record_tag, attrib=record_attrib)
+        _sort_elements(section, unique, dedup_mode)
+        _write_indent(xf, pretty)
+        xf.write(section)
+    else:
+        # Bind the lookups once, this runs for every term of the system
+        write = xf.write
+        element = ET.Element
+        _write_indent(xf, pretty)
+        with xf.element(tag, attrib=attrib):
+            yield lambda record_tag, attrib: write(element(record_tag, attrib))
+
+
+def _write_atoms(self, xf, atoms, forcefield, unique, dedup_mode, pretty):
+    combining_rule = getattr(forcefield, "combining_rule", self.combining_rule)
+    nonbonded_attrib = {
+        "coulomb14scale": str(_infer_coulomb14scale(self)),
+        "lj14scale": str(_infer_lj14scale(self, combining_rule)),
+    }
 
-def _update_defs(atomtypes, nonbonded, forcefield):
+    # The atom types (one per type, not per atom) stay in memory until
+    # `_update_defs` has seen all of them.
+    atomtypes = ET.Element("AtomTypes")
+    atom_type_set = set([atom.atom_type.name for atom in atoms])
+    written_atom_types = set()
+    for atom in atoms:
+        name = atom.atom_type.name
+        if name in written_atom_types:
+            continue
+        written_atom_types.add(name)
+        overrides_comment = None
+        if forcefield is None:
+            atomtype_attrib = {
+                "name": name,
+                "class": "",
+                "element": "",
+                "mass": str(atom.mass),
+                "def": "",
+                "desc": "",
+                "doi": "",
+                "overrides": "",
+            }
+        else:
+            # Attributes missing from the forcefield are written as blanks
+            atomtype_attrib = {
+                "name": name,
+                "class": forcefield.atomTypeClasses.get(name, ""),
+                "element": forcefield.atomTypeElements.get(name, ""),
+                "mass": str(atom.mass),
+                "def": forcefield.atomTypeDefinitions.get(name, ""),
+                "desc": forcefield.atomTypeDesc.get(name, ""),
+                "doi": ",".join(forcefield.atomTypeRefs.get(name, ())),
+                "overrides": "",
+            }
+            original_overrides = forcefield.atomTypeOverrides.get(name)
+            if original_overrides:
+                # Only write overrides atomtypes if they are in atom_type_set
+                atomtype_attrib["overrides"] = ",".join(
+                    [a for a in original_overrides if a in atom_type_set]
+                )
+                # Write out the original overrides atomtypes as a comment
+                overrides_comment = 'Note: original overrides="{}"'.format(
+                    ",".join([a for a in original_overrides])
+                )
+        atomtype = ET.SubElement(atomtypes, "Type", attrib=atomtype_attrib)
+        if overrides_comment is not None:
+            atomtype.append(ET.Comment(overrides_comment))
+
+    if forcefield is not None:
+        _update_defs(atomtypes, forcefield)
+    _sort_elements(atomtypes, unique, dedup_mode)
+    _write_indent(xf, pretty)
+    xf.write(atomtypes)
+
+    with _write_section(
+        xf, "NonbondedForce", unique, dedup_mode, pretty, nonbonded_attrib
+    ) as add_record:
+        for atom in atoms:
+            atom_type = atom.atom_type
+            nb_force = dict()
+            if not unique:
+                nb_force["id"] = str(atom.idx)
+            nb_force["type"] = atom_type.name
+            nb_force["charge"] = _format_charge(atom.charge)
+            nb_force["sigma"] = _format_sigma(atom_type.sigma)
+            nb_force["epsilon"] = _format_epsilon(atom_type.epsilon)
+            add_record("Atom", nb_force)
+
+
+def _update_defs(atomtypes, forcefield):
     def_list = [i.get("def") for i in atomtypes.iterchildren()]
     name_list = [i.get("name") for i in atomtypes.iterchildren()]
     smarts_list = list()
@@ -203,200 +393,225 @@ def _update_defs(atomtypes, nonbonded, forcefield):
                 atomtypes[i].set("def", new_def)
 
 
-def _write_bonds(root, bonds, unique):
-    bond_forces = ET.SubElement(root, "HarmonicBondForce")
-    for bond in bonds:
-        bond_force = ET.SubElement(bond_forces, "Bond")
-        atypes = [atype for atype in [bond.atom1.type, bond.atom2.type]]
-        if unique:
-            atypes = sorted(atypes)
-        else:
-            bond_force.set("id1", str(bond.atom1.idx))
-            bond_force.set("id2", str(bond.atom2.idx))
-        for id in range(2):
-            bond_force.set("type{}".format(id + 1), atypes[id])
-        bond_force.set("length", str(round(bond.type.req / 10, 4)))
-        bond_force.set("k", str(round(bond.type.k * 4.184 * 200, 1)))
-
-
-def _write_angles(root, angles, unique):
-    angle_forces = ET.SubElement(root, "HarmonicAngleForce")
-    for angle in angles:
-        angle_force = ET.SubElement(angle_forces, "Angle")
-        atypes = [
-            atype
-            for atype in [angle.atom1.type, angle.atom2.type, angle.atom3.type]
-        ]
-        if unique:
-            # Sort the first and last atom types
-            atypes[::2] = sorted(atypes[::2])
-        else:
-            angle_force.set("id1", str(angle.atom1.idx))
-            angle_force.set("id2", str(angle.atom2.idx))
-            angle_force.set("id3", str(angle.atom3.idx))
-        for id in range(3):
-            angle_force.set("type{}".format(id + 1), atypes[id])
-        angle_force.set(
-            "angle", str(round(angle.type.theteq * (np.pi / 180), 10))
-        )
-        angle_force.set("k", str(round(angle.type.k * 4.184 * 2, 3)))
-
-
-def _write_periodic_torsions(root, dihedrals, unique):
-    periodic_torsion_forces = ET.SubElement(root, "PeriodicTorsionForce")
-    last_dihedral_force = None
-    for dihedral in dihedrals:
-        if dihedral.improper:
-            dihedral_type = "Improper"
-        else:
-            dihedral_type = "Proper"
-        dihedral_force = ET.SubElement(periodic_torsion_forces, dihedral_type)
-        atypes = [
-            atype
-            for atype in [
-                dihedral.atom1.type,
-                dihedral.atom2.type,
-                dihedral.atom3.type,
-                dihedral.atom4.type,
-            ]
-        ]
-        if dihedral.improper:
-            # We want the central atom listed first and then sort the
-            # remaining atom types.
-            atypes[0], atypes[2] = atypes[2], atypes[0]
+def _write_bonds(xf, bonds, unique, dedup_mode, pretty):
+    with _write_section(
+        xf, "HarmonicBondForce", unique, dedup_mode, pretty
+    ) as add_record:
+        seen = set()
+        for bond in bonds:
+            atype1, atype2, bond_type = _BOND_GETTER(bond)
+            bond_force = dict()
             if unique:
-                atypes[1:] = sorted(atypes[1:])
+                # Skip bonds giving an already added record
+                key = (id(bond_type), atype1, atype2)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if atype1 > atype2:
+                    atype1, atype2 = atype2, atype1
             else:
-                dihedral_force.set("id1", str(dihedral.atom3.idx))
-                dihedral_force.set("id2", str(dihedral.atom2.idx))
-                dihedral_force.set("id3", str(dihedral.atom1.idx))
-                dihedral_force.set("id4", str(dihedral.atom4.idx))
-        else:
+                id1, id2 = _BOND_IDS(bond)
+                bond_force["id1"] = str(id1)
+                bond_force["id2"] = str(id2)
+            bond_force["type1"] = atype1
+            bond_force["type2"] = atype2
+            length, k = _format_bond_parameters(*_BOND_PARAMETERS(bond_type))
+            bond_force["length"] = length
+            bond_force["k"] = k
+            add_record("Bond", bond_force)
+
+
+def _write_angles(xf, angles, unique, dedup_mode, pretty):
+    with _write_section(
+        xf, "HarmonicAngleForce", unique, dedup_mode, pretty
+    ) as add_record:
+        seen = set()
+        for angle in angles:
+            atype1, atype2, atype3, angle_type = _ANGLE_GETTER(angle)
+            angle_force = dict()
             if unique:
-                if atypes[0] > atypes[-1]:
-                    atypes = atypes[::-1]
+                # Skip angles giving an already added record
+                key = (id(angle_type), atype1, atype2, atype3)
+                if key in seen:
+                    continue
+                seen.add(key)
+                # Sort the first and last atom types
+                if atype1 > atype3:
+                    atype1, atype3 = atype3, atype1
             else:
-                dihedral_force.set("id1", str(dihedral.atom1.idx))
-                dihedral_force.set("id2", str(dihedral.atom2.idx))
-                dihedral_force.set("id3", str(dihedral.atom3.idx))
-                dihedral_force.set("id4", str(dihedral.atom4.idx))
-        for id in range(4):
-            dihedral_force.set("type{}".format(id + 1), atypes[id])
-        dihedral_force.set("periodicity1", str(dihedral.type.per))
-        dihedral_force.set(
-            "phase1", str(round(dihedral.type.phase * (np.pi / 180), 8))
-        )
-        dihedral_force.set("k1", str(round(dihedral.type.phi_k * 4.184, 3)))
-        if last_dihedral_force is not None:
-            # Check to see if this current dihedral force needs to be
-            # "merged" into the last dihedral force
-            last_dihedral_tuple = (
-                last_dihedral_force.attrib["type1"],
-                last_dihedral_force.attrib["type2"],
-                last_dihedral_force.attrib["type3"],
-                last_dihedral_force.attrib["type4"],
-            )
-            current_dihedral_tuple = (
-                dihedral_force.attrib["type1"],
-                dihedral_force.attrib["type2"],
-                dihedral_force.attrib["type3"],
-                dihedral_force.attrib["type4"],
+                id1, id2, id3 = _ANGLE_IDS(angle)
+                angle_force["id1"] = str(id1)
+                angle_force["id2"] = str(id2)
+                angle_force["id3"] = str(id3)
+            angle_force["type1"] = atype1
+            angle_force["type2"] = atype2
+            angle_force["type3"] = atype3
+            theta, k = _format_angle_parameters(*_ANGLE_PARAMETERS(angle_type))
+            angle_force["angle"] = theta
+            angle_force["k"] = k
+            add_record("Angle", angle_force)
+
+
+def _write_periodic_torsions(xf, dihedrals, unique, dedup_mode, pretty):
+    with _write_section(
+        xf, "PeriodicTorsionForce", unique, dedup_mode, pretty
+    ) as add_record:
+        # The last dihedral force is held back until we know whether the
+        # following dihedrals need to be merged into it.
+        last_dihedral_type = None
+        last_dihedral_force = None
+        for dihedral in dihedrals:
+            atypes = _TORSION_TYPES(dihedral)
+            dihedral_force = dict()
+            if not unique:
+                id1, id2, id3, id4 = _TORSION_IDS(dihedral)
+            if dihedral.improper:
+                dihedral_type = "Improper"
+                # We want the central atom listed first and then sort the
+                # remaining atom types.
+                atypes = (atypes[2], atypes[1], atypes[0], atypes[3])
+                if unique:
+                    atypes = (atypes[0], *sorted(atypes[1:]))
+                else:
+                    dihedral_force["id1"] = str(id3)
+                    dihedral_force["id2"] = str(id2)
+                    dihedral_force["id3"] = str(id1)
+                    dihedral_force["id4"] = str(id4)
+            else:
+                dihedral_type = "Proper"
+                if unique:
+                    if atypes[0] > atypes[-1]:
+                        atypes = atypes[::-1]
+                else:
+                    dihedral_force["id1"] = str(id1)
+                    dihedral_force["id2"] = str(id2)
+                    dihedral_force["id3"] = str(id3)
+                    dihedral_force["id4"] = str(id4)
+            dihedral_force["type1"] = atypes[0]
+            dihedral_force["type2"] = atypes[1]
+            dihedral_force["type3"] = atypes[2]
+            dihedral_force["type4"] = atypes[3]
+            periodicity, phase, k = _format_periodic_torsion_parameters(
+                *_DIHEDRAL_PARAMETERS(dihedral.type)
             )
-            if (
-                last_dihedral_tuple == current_dihedral_tuple
-                and _unique_periodictorsion_parameters(
-                    last_dihedral_force, dihedral_force
+            dihedral_force["periodicity1"] = periodicity
+            dihedral_force["phase1"] = phase
+            dihedral_force["k1"] = k
+            if last_dihedral_force is not None:
+                # Check to see if this current dihedral force needs to be
+                # "merged" into the last dihedral force
+                last_dihedral_tuple = (
+                    last_dihedral_force["type1"],
+                    last_dihedral_force["type2"],
+                    last_dihedral_force["type3"],
+                    last_dihedral_force["type4"],
                 )
-            ):
-                # Merge the last and current dihedral forces
-                # Find the nth periodicity we can set
-                n = 1
-                while "periodicity{}".format(n) in last_dihedral_force.attrib:
-                    n += 1
-                last_dihedral_force.attrib[
-                    "periodicity{}".format(n)
-                ] = dihedral_force.attrib["periodicity1"]
-                last_dihedral_force.attrib[
-                    "phase{}".format(n)
-                ] = dihedral_force.attrib["phase1"]
-                last_dihedral_force.attrib[
-                    "k{}".format(n)
-                ] = dihedral_force.attrib["k1"]
-                periodic_torsion_forces.remove(dihedral_force)
-            else:
-                last_dihedral_force = dihedral_force
-
-        else:
+                current_dihedral_tuple = (
+                    dihedral_force["type1"],
+                    dihedral_force["type2"],
+                    dihedral_force["type3"],
+                    dihedral_force["type4"],
+                )
+                if (
+                    last_dihedral_tuple == current_dihedral_tuple
+                    and _unique_periodictorsion_parameters(
+                        last_dihedral_force, dihedral_force
+                    )
+                ):
+                    # Merge the last and current dihedral forces
+                    # Find the nth periodicity we can set
+                    n = 1
+                    while "periodicity{}".format(n) in last_dihedral_force:
+                        n += 1
+                    last_dihedral_force[
+                        "periodicity{}".format(n)
+                    ] = dihedral_force["periodicity1"]
+                    last_dihedral_force["phase{}".format(n)] = dihedral_force[
+                        "phase1"
+                    ]
+                    last_dihedral_force["k{}".format(n)] = dihedral_force["k1"]
+                    continue
+                add_record(last_dihedral_type, last_dihedral_force)
+            last_dihedral_type = dihedral_type
             last_dihedral_force = dihedral_force
 
+        if last_dihedral_force is not None:
+            add_record(last_dihedral_type, last_dihedral_force)
+
 
 def _unique_periodictorsion_parameters(dihedral1, dihedral2):
     """Return true if dihedral1 contains the parameters of dihedral2.
 
     Parameters
     ----------
-    dihedral1: ET.subelement
-        This is the "larger" dihedral ETelement that is collecting multiple
-        periodicities
-    dihedral2: ET.subelement
-        This should only contain periodicity1, phase1, k1 attributes
+    dihedral1: dict
+        Attributes of the "larger" dihedral force that is collecting
+        multiple periodicities
+    dihedral2: dict
+        Attributes of a dihedral force, this should only contain
+        periodicity1, phase1, k1 parameters
     """
     n = 1
     param_tuples = set()
-    while "periodicity{}".format(n) in dihedral1.attrib:
+    while "periodicity{}".format(n) in dihedral1:
         param_tuples.add(
             (
-                dihedral1.attrib["periodicity{}".format(n)],
-                dihedral1.attrib["phase{}".format(n)],
-                dihedral1.attrib["k{}".format(n)],
+                dihedral1["periodicity{}".format(n)],
+                dihedral1["phase{}".format(n)],
+                dihedral1["k{}".format(n)],
             )
         )
         n += 1
     if (
-        dihedral2.attrib["periodicity1"],
-        dihedral2.attrib["phase1"],
-        dihedral2.attrib["k1"],
+        dihedral2["periodicity1"],
+        dihedral2["phase1"],
+        dihedral2["k1"],
     ) in param_tuples:
         return False
     else:
         return True
 
 
-def _write_rb_torsions(root, rb_torsions, unique):
-    rb_torsion_forces = ET.SubElement(root, "RBTorsionForce")
-    for rb_torsion in rb_torsions:
-        rb_torsion_force = ET.SubElement(rb_torsion_forces, "Proper")
-        atypes = [
-            atype
-            for atype in [
-                rb_torsion.atom1.type,
-                rb_torsion.atom2.type,
-                rb_torsion.atom3.type,
-                rb_torsion.atom4.type,
-            ]
-        ]
-        if unique:
-            if atypes[0] > atypes[-1]:
-                atypes = atypes[::-1]
-        else:
-            rb_torsion_force.set("id1", str(rb_torsion.atom1.idx))
-            rb_torsion_force.set("id2", str(rb_torsion.atom2.idx))
-            rb_torsion_force.set("id3", str(rb_torsion.atom3.idx))
-            rb_torsion_force.set("id4", str(rb_torsion.atom4.idx))
-        for id in range(4):
-            rb_torsion_force.set("type{}".format(id + 1), atypes[id])
-        for c_id in range(6):
-            rb_torsion_force.set(
-                "c{}".format(c_id),
-                str(
-                    round(
-                        getattr(rb_torsion.type, "c{}".format(c_id)) * 4.184, 4
-                    )
-                ),
+def _write_rb_torsions(xf, rb_torsions, unique, dedup_mode, pretty):
+    with _write_section(
+        xf, "RBTorsionForce", unique, dedup_mode, pretty
+    ) as add_record:
+        seen = set()
+        for rb_torsion in rb_torsions:
+            atypes = _TORSION_TYPES(rb_torsion)
+            rb_type = rb_torsion.type
+            rb_torsion_force = dict()
+            if unique:
+                # Skip RB torsions giving an already added record
+                key = (id(rb_type), atypes)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if atypes[0] > atypes[-1]:
+                    atypes = atypes[::-1]
+            else:
+                id1, id2, id3, id4 = _TORSION_IDS(rb_torsion)
+                rb_torsion_force["id1"] = str(id1)
+                rb_torsion_force["id2"] = str(id2)
+                rb_torsion_force["id3"] = str(id3)
+                rb_torsion_force["id4"] = str(id4)
+            rb_torsion_force["type1"] = atypes[0]
+            rb_torsion_force["type2"] = atypes[1]
+            rb_torsion_force["type3"] = atypes[2]
+            rb_torsion_force["type4"] = atypes[3]
+            coefficients = _format_rb_torsion_parameters(
+                *_RB_COEFFICIENTS(rb_type)
             )
+            rb_torsion_force.update(zip(_C_KEYS, coefficients))
+            add_record("Proper", rb_torsion_force)
+
 
+def _sort_elements(section, unique, dedup_mode):
+    """Sort the records of `section` by atom type.
 
-def _remove_duplicate_elements(root, unique):
+    Duplicate records are never written, so only their order is left to fix,
+    and even that is skipped when `dedup_mode` is "none".
+    """
     sortby = {
         "AtomTypes": ["name"],
         "HarmonicBondForce": ["type1", "type2"],
@@ -405,86 +620,96 @@ def _remove_duplicate_elements(root, unique):
         "RBTorsionForce": ["type1", "type2", "type3", "type4"],
         "NonbondedForce": ["type"],
     }
-    prev = None
-    for child in root:
-        if not unique and child.tag != "AtomTypes":
-            continue
-        child[:] = sorted(
-            child,
-            key=lambda elem: tuple(elem.get(id) for id in sortby[child.tag]),
-        )
-        elems_to_remove = []
-        for elem in child:
-            if _elements_equal(elem, prev):
-                elems_to_remove.append(elem)
-                continue
-            prev = elem
-        for elem_to_remove in elems_to_remove:
-            child.remove(elem_to_remove)
-
-
-def _elements_equal(e1, e2):
-    """Determine if two elements are equivalent.
-
-    Note: This was grabbed, basically verbatim, from:
-    https://stackoverflow.com/questions/7905380/testing-equivalence-of-xml-etree-elementtree
-    """
-    if type(e1) != type(e2):
-        return False
-    if e1.tag != e2.tag:
-        return False
-    if e1.text != e2.text:
-        return False
-    if e1.tail != e2.tail:
-        return False
-    if e1.attrib != e2.attrib:
-        return False
-    if len(e1) != len(e2):
-        return False
-    return all([_elements_equal(c1, c2) for c1, c2 in zip(e1, e2)])
+    if dedup_mode == "none" or (not unique and section.tag != "AtomTypes"):
+        return
+    # Extract each sort key once and order the records with a single
+    # lexsort, the last key passed to `np.lexsort` being the primary one.
+    elems = list(section)
+    columns = [
+        np.array([elem.get(id) for elem in elems], dtype=str)
+        for id in sortby[section.tag]
+    ]
+    order = np.lexsort(columns[::-1])
+    section[:] = [elems[i] for i in order]
 
 
 def _infer_coulomb14scale(struct):
     """Attempt to infer the coulombic 1-4 scaling factor in the structure."""
-    coul14 = [t.type.chgscale for t in struct.adjusts]
-
-    if len(set(coul14)) == 1:
-        return coul14[0]
-    else:
-        raise ValueError(
-            "Structure has inconsistent 1-4 coulomb scaling factors. This is "
-            "currently not supported"
-        )
+    # Stop at the first factor differing from that of the first adjust
+    adjusts = iter(struct.adjusts)
+    first = next(adjusts, None)
+    if first is not None:
+        coul14 = first.type.chgscale
+        if all(adj.type.chgscale == coul14 for adj in adjusts):
+            return coul14
+    raise ValueError(
+        "Structure has inconsistent 1-4 coulomb scaling factors. This is "
+        "currently not supported"
+    )
 
 
 def _infer_lj14scale(struct, combining_rule: str):
     """Infer the Lennard-Jones 1-4 scaling factor in the structure."""
-    lj14scale = list()
-
-    for adj in struct.adjusts:
-        type1 = adj.atom1.atom_type
-        type2 = adj.atom2.atom_type
-        if combining_rule == "lorentz":
-            expected_sigma = (type1.sigma + type2.sigma) * 0.5
-        elif combining_rule == "geometric":
-            expected_sigma = (type1.sigma * type2.sigma) ** 0.5
-        expected_epsilon = (type1.epsilon * type2.epsilon) ** 0.5
-
-        # We expect sigmas to be the same but epsilons to be scaled by a factor
-        if not np.isclose(adj.type.sigma, expected_sigma):
-            raise ValueError(
-                "Unexpected 1-4 sigma value found in adj {}. Expected {}"
-                "and found {}. This estimate was made assuming a combining "
-                "rule of {}".format(
-                    adj, adj.type.sigma, expected_sigma, combining_rule
-                )
+    # Columns: sigma1, sigma2, epsilon1, epsilon2, 1-4 sigma, 1-4 epsilon
+    params = np.array(
+        [
+            (
+                adj.atom1.atom_type.sigma,
+                adj.atom2.atom_type.sigma,
+                adj.atom1.atom_type.epsilon,
+                adj.atom2.atom_type.epsilon,
+                adj.type.sigma,
+                adj.type.epsilon,
+            )
+            for adj in struct.adjusts
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 6)
+    sigma1, sigma2, epsilon1, epsilon2, adj_sigma, adj_epsilon = params.T
+
+    if combining_rule == "lorentz":
+        expected_sigma = (sigma1 + sigma2) * 0.5
+    elif combining_rule == "geometric":
+        expected_sigma = np.sqrt(sigma1 * sigma2)
+    expected_epsilon = np.sqrt(epsilon1 * epsilon2)
+
+    # We expect sigmas to be the same but epsilons to be scaled by a factor
+    unexpected_sigma = ~np.isclose(adj_sigma, expected_sigma)
+    if unexpected_sigma.any():
+        idx = int(np.argmax(unexpected_sigma))
+        raise ValueError(
+            "Unexpected 1-4 sigma value found in adj {}. Expected {}"
+            "and found {}. This estimate was made assuming a combining "
+            "rule of {}".format(
+                struct.adjusts[idx],
+                adj_sigma[idx],
+                expected_sigma[idx],
+                combining_rule,
             )
+        )
 
-        lj14scale.append(adj.type.epsilon / expected_epsilon)
+    # Pairs without dispersion carry no scaling factor, so they are skipped
+    # as long as their 1-4 epsilon is zero too
+    zero_epsilon = expected_epsilon == 0
+    unexpected_epsilon = zero_epsilon & (adj_epsilon != 0)
+    if unexpected_epsilon.any():
+        idx = int(np.argmax(unexpected_epsilon))
+        raise ValueError(
+            "Unexpected 1-4 epsilon value found in adj {}. Expected 0.0 "
+            "and found {}, which no 1-4 LJ scaling factor can "
+            "reproduce".format(struct.adjusts[idx], adj_epsilon[idx])
+        )
+    if len(zero_epsilon) and zero_epsilon.all():
+        raise ValueError(
+            "Cannot infer the 1-4 LJ scaling factor, every 1-4 pair in "
+            "the structure has an epsilon of zero"
+        )
 
-    unique_lj14_scales = np.unique(np.array(lj14scale).round(8))
+    has_epsilon = ~zero_epsilon
+    lj14scale = adj_epsilon[has_epsilon] / expected_epsilon[has_epsilon]
+    unique_lj14_scales = np.unique(lj14scale.round(8))
     if len(unique_lj14_scales) == 1:
-        return lj14scale[0]
+        return float(lj14scale[0])
     else:
         raise ValueError(
             "Structure has inconsistent 1-4 LJ scaling factors. This is "